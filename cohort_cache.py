@@ -0,0 +1,230 @@
+import numpy as np
+import pandas as pd
+import pickle
+import secrets
+import hashlib
+import fcntl
+import json
+import mmap
+import time
+import sys
+import os
+from multiprocessing import shared_memory
+from multiprocessing import resource_tracker
+
+#Cache shared by the query objects of a process, created by cohort_cache() on first use
+default_cache = None
+
+def cohort_cache():
+    """
+    Returns the default cache of the process, created with the default memory cap on first use
+    """
+    global default_cache
+    if default_cache is None:
+        default_cache = gdc_cache()
+    return default_cache
+
+class gdc_cache:
+    """
+    Creates cache objects that share loaded cohort matrices (gdc_rnaseq, gdc_mirna, ...) between processes.
+    The first process to load a matrix publishes it in shared memory together with its gene and sample
+    index, and later processes attach to the same block without copying it. Blocks are reference counted
+    per process and evicted least recently used first once the cache exceeds its memory cap.
+    The registry of blocks is a json file under the cache directory, locked while it is updated.
+    """
+
+    def __init__(self, cap=8*2**30, directory=None):
+        #Maximum number of bytes held in shared memory by the cache
+        self.cap = cap
+        #Folder of the registry shared by every process using the cache
+        self.main_dir = directory or os.path.join(os.getcwd(),"data","Cache")
+        if not os.path.exists(self.main_dir):
+            os.makedirs(self.main_dir)
+        self.file = os.path.join(self.main_dir,"registry.json")
+        self.lock_file = os.path.join(self.main_dir,"registry.lock")
+
+    def _open(self):
+        #Lock the registry and read it, the caller writes it back with _close
+        lock = open(self.lock_file, "a")
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        registry = {}
+        if os.path.exists(self.file):
+            with open(self.file) as f:
+                registry = json.load(f)
+        return lock, registry
+
+    def _close(self, lock, registry):
+        with open(self.file + ".tmp", "w") as f:
+            json.dump(registry, f)
+        os.replace(self.file + ".tmp", self.file)
+        fcntl.flock(lock, fcntl.LOCK_UN)
+        lock.close()
+
+    @staticmethod
+    def _shm(name, create=False, size=0):
+        #The blocks outlive the process that created or attached them, and are only unlinked on eviction,
+        #so they are kept out of the resource tracker which would unlink them when the process exits
+        if sys.version_info >= (3, 13):
+            return shared_memory.SharedMemory(name=name, create=create, size=size, track=False)
+        shm = shared_memory.SharedMemory(name=name, create=create, size=size)
+        #The tracker registers the posix name, which is the public name with a leading slash
+        resource_tracker.unregister("/" + shm.name, "shared_memory")
+        return shm
+
+    @staticmethod
+    def _alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def _evict(self, registry, size):
+        #Unlink unreferenced blocks, least recently used first, until size more bytes fit under the cap
+        for entry in registry.values():
+            entry["refs"] = [pid for pid in entry["refs"] if self._alive(pid)]
+        used = sum(entry["size"] for entry in registry.values())
+        for key in sorted(registry, key=lambda key: registry[key]["used"]):
+            if used + size <= self.cap:
+                break
+            if registry[key]["refs"]:
+                continue
+            for name in (registry[key]["name"], registry[key]["index"]):
+                try:
+                    #Attached through the resource tracker, since unlink unregisters the block
+                    shm = shared_memory.SharedMemory(name=name)
+                    shm.close()
+                    shm.unlink()
+                except FileNotFoundError:
+                    pass
+            used -= registry[key]["size"]
+            del registry[key]
+        return used + size <= self.cap
+
+    def _frame(self, entry):
+        #Build a dataframe on top of the shared block, read only so no process modifies the shared data
+        shm_index = self._shm(entry["index"])
+        index, columns = pickle.loads(bytes(shm_index.buf[:entry["index_size"]]))
+        shm_index.close()
+
+        #The block is mapped directly rather than through a SharedMemory object, so the mapping belongs to
+        #the array: it is the base of the array and of every view pandas makes of it, and is unmapped only
+        #once the last of them is garbage collected. A read only mapping makes the array read only.
+        with open(os.path.join("/dev/shm", entry["name"]), "rb") as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        values = np.frombuffer(mapping, dtype=entry["dtype"], count=int(np.prod(entry["shape"]))).reshape(entry["shape"])
+        return pd.DataFrame(values, index=index, columns=columns, copy=False)
+
+    def data_attach(self, key):
+        """
+        Attaches to a published matrix without copying it
+        Input: key of the matrix (e.g. 'RNASeq/LIHC')
+        Output: read only pandas dataframe backed by shared memory, or None if the key is not published
+        """
+        lock, registry = self._open()
+        try:
+            entry = registry.get(key)
+            if entry is None:
+                return None
+            entry["refs"].append(os.getpid())
+            entry["used"] = time.time()
+            return self._frame(entry)
+        finally:
+            self._close(lock, registry)
+
+    def data_publish(self, key, data):
+        """
+        Publishes a matrix in shared memory, evicting unreferenced matrices if it does not fit under the cap
+        Inputs: key of the matrix, data = pandas dataframe with a single numeric dtype
+        Output: read only pandas dataframe backed by shared memory (the published matrix if another
+        process published the key first), raises MemoryError if the matrix does not fit
+        """
+        if data.empty:
+            raise ValueError("%s is empty, the matrix was not loaded and is not published" % key)
+        values = np.ascontiguousarray(data.values)
+        #Python objects are pointers into the memory of this process, meaningless to other processes
+        if values.dtype.hasobject:
+            raise TypeError("%s has non numeric columns, only numeric matrices can be published" % key)
+        index = pickle.dumps((data.index, data.columns))
+
+        lock, registry = self._open()
+        try:
+            if key in registry:
+                registry[key]["refs"].append(os.getpid())
+                registry[key]["used"] = time.time()
+                return self._frame(registry[key])
+
+            size = values.nbytes + len(index)
+            if not self._evict(registry, size):
+                raise MemoryError("%s (%d bytes) does not fit in the cache cap of %d bytes" % (key, size, self.cap))
+
+            #Shared memory blocks must not be empty
+            shm = self._shm("gdc_" + secrets.token_hex(8), create=True, size=max(values.nbytes, 1))
+            np.ndarray(values.shape, dtype=values.dtype, buffer=shm.buf)[:] = values
+            shm_index = self._shm("gdc_" + secrets.token_hex(8), create=True, size=len(index))
+            shm_index.buf[:len(index)] = index
+            shm_index.close()
+            shm.close()
+
+            registry[key] = {"name": shm.name, "index": shm_index.name, "index_size": len(index),
+                             "shape": list(values.shape), "dtype": values.dtype.str, "size": size,
+                             "refs": [os.getpid()], "used": time.time()}
+            return self._frame(registry[key])
+        finally:
+            self._close(lock, registry)
+
+    def data_load(self, key, loader):
+        """
+        Attaches to a published matrix, or loads and publishes it if no process has yet
+        Inputs: key of the matrix, loader = function returning the matrix as a pandas dataframe
+        Output: pandas dataframe, a private copy if the matrix does not fit in the cache, raises
+        ValueError if the loader returns an empty dataframe
+        """
+        data = self.data_attach(key)
+        if data is not None:
+            return data
+
+        #Only one process loads a key: the others wait on the lock of the key and attach to the matrix it
+        #published. The registry lock is not held while loading, so other keys are not blocked.
+        lock = open(os.path.join(self.main_dir, "load_" + hashlib.md5(key.encode()).hexdigest() + ".lock"), "a")
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            data = self.data_attach(key)
+            if data is not None:
+                return data
+            data = loader()
+            try:
+                return self.data_publish(key, data)
+            except MemoryError as e:
+                print(str(e) + ", using a private copy")
+                return data
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+            lock.close()
+
+    def data_release(self, key):
+        """
+        Releases the reference of this process to a matrix, unreferenced matrices stay cached until they
+        are evicted. A dataframe still in use stays valid, its memory is unmapped when it is garbage collected.
+        """
+        lock, registry = self._open()
+        try:
+            if key in registry and os.getpid() in registry[key]["refs"]:
+                registry[key]["refs"].remove(os.getpid())
+        finally:
+            self._close(lock, registry)
+
+    def data_clear(self):
+        """
+        Unlinks every unreferenced matrix of the cache
+        """
+        lock, registry = self._open()
+        try:
+            cap = self.cap
+            self.cap = 0
+            self._evict(registry, 0)
+            self.cap = cap
+        finally:
+            self._close(lock, registry)
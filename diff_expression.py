@@ -0,0 +1,186 @@
+import numpy as np
+import pandas as pd
+import os
+from scipy import special
+from scipy import stats
+from concurrent.futures import ProcessPoolExecutor
+from omics_dataset import file_barcodes
+
+def welch_ttest(x, y):
+    """
+    Welch's t-test of every row of x against the same row of y
+    Inputs: x (gene x sample) and y (gene x sample) arrays
+    Output: (t statistics, two sided p-values) arrays
+    """
+    nx, ny = x.shape[1], y.shape[1]
+    vx = x.var(axis=1, ddof=1) / nx
+    vy = y.var(axis=1, ddof=1) / ny
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (x.mean(axis=1) - y.mean(axis=1)) / np.sqrt(vx + vy)
+        #Welch-Satterthwaite degrees of freedom
+        df = (vx + vy)**2 / (vx**2 / (nx - 1) + vy**2 / (ny - 1))
+    return t, 2 * special.stdtr(df, -np.abs(t))
+
+def ranksum(x, y):
+    """
+    Wilcoxon rank-sum (Mann-Whitney U) test of every row of x against the same row of y,
+    with the tie corrected normal approximation
+    Output: (U statistics of x, two sided p-values) arrays
+    """
+    result = stats.mannwhitneyu(x, y, axis=1, method='asymptotic', alternative='two-sided')
+    return result.statistic, result.pvalue
+
+def bh_adjust(p):
+    """
+    Benjamini-Hochberg adjusted p-values, NaN p-values are left out of the correction
+    """
+    p = np.asarray(p, dtype=float)
+    adjusted = np.full(p.shape, np.nan)
+    valid = np.flatnonzero(~np.isnan(p))
+    order = valid[np.argsort(p[valid])]
+    ranked = p[order] * len(order) / np.arange(1, len(order)+1)
+    #Enforce monotonicity from the largest p-value down
+    adjusted[order] = np.minimum(1, np.minimum.accumulate(ranked[::-1])[::-1])
+    return adjusted
+
+def de_chunk(file, tumor, normal, start, stop, log=True):
+    """
+    Computes the statistics of a chunk of genes of a stored expression matrix, runs in a worker process
+    Inputs: file = .npy expression matrix (gene x sample), tumor and normal column positions,
+    start and stop rows of the chunk, log = compare log2(x+1) transformed values
+    Output: (start, dictionary of statistic arrays)
+    """
+    #Every worker maps the same file, only the rows of the chunk are read
+    chunk = np.load(file, mmap_mode='r')[start:stop]
+    x = chunk[:, tumor].astype(np.float64)
+    y = chunk[:, normal].astype(np.float64)
+    if log:
+        x = np.log2(x + 1)
+        y = np.log2(y + 1)
+
+    mean_tumor = x.mean(axis=1)
+    mean_normal = y.mean(axis=1)
+    #Log transformed means differ by the log fold change, raw means are divided
+    fold_change = mean_tumor - mean_normal if log else np.log2((mean_tumor + 1) / (mean_normal + 1))
+
+    t, t_pvalue = welch_ttest(x, y)
+    u, u_pvalue = ranksum(x, y)
+    return start, {'mean_tumor': mean_tumor, 'mean_normal': mean_normal, 'log2FC': fold_change,
+                   't': t, 't_pvalue': t_pvalue, 'U': u, 'u_pvalue': u_pvalue}
+
+class gdc_de:
+    """
+    Creates data objects that run a tumor vs Solid Tissue Normal differential expression analysis on
+    a gdc_rnaseq object. Fold change, Welch t-test and rank-sum statistics with BH adjusted p-values are
+    computed as whole matrix operations on chunks of genes, spread across cores.
+    """
+
+    def __init__(self, rnaseq, tumor=None, normal=None):
+        #Gene expression object to analyse
+        self.rnaseq = rnaseq
+        self.name = rnaseq.name
+        #Columns of the tumor and normal samples, derived from the sample barcodes if not given
+        self.tumor = tumor
+        self.normal = normal
+        #Location of the expression matrix read by the worker processes
+        self.file = os.path.join(rnaseq.query_dir,rnaseq.name+"_expression.npy")
+        #Initialize the results dataframe (gene x statistic)
+        self.results = pd.DataFrame()
+
+    def data_labels(self):
+        """
+        Labels the columns of the expression matrix as tumor (sample type 01-09) or Solid Tissue Normal
+        (sample type 11) from the sample barcodes of the columns, or of the files the columns are named by
+        Output: self.tumor and self.normal store the lists of columns
+        """
+        columns = self.rnaseq.data.columns
+        #Columns already named by barcode (e.g. by gdc_dataset) are used directly, file uuids are mapped
+        if str(columns[0]).startswith('TCGA-'):
+            barcodes = {column: column for column in columns}
+        else:
+            barcodes = file_barcodes(columns)
+        #Patient level barcodes (TCGA-XX-XXXX, e.g. from gdc_dataset(level='patient')) carry no sample type
+        short = [column for column in columns if column in barcodes and not barcodes[column][13:15].isdigit()]
+        if short:
+            raise ValueError("%s: %d columns are not named by sample level barcodes (e.g. %s), the sample type "
+                             "needs TCGA-XX-XXXX-NN barcodes or explicit tumor= / normal= columns"
+                             % (self.name, len(short), barcodes[short[0]]))
+        #Sample type is the two digits after the patient in the barcode, TCGA-XX-XXXX-11A
+        sample_type = pd.Series({column: int(barcodes[column][13:15]) for column in columns if column in barcodes})
+        self.tumor = sample_type.index[sample_type < 10].tolist()
+        self.normal = sample_type.index[sample_type == 11].tolist()
+
+    def data_write(self):
+        """
+        Writes the expression matrix to disk, so that worker processes map it instead of receiving a copy
+        """
+        if not os.path.exists(self.rnaseq.query_dir):
+            os.makedirs(self.rnaseq.query_dir)
+        np.save(self.file, self.rnaseq.data.values)
+
+    def data_chunks(self, chunk_size=5000, log=True):
+        """
+        Returns the arguments of de_chunk for every chunk of genes of the analysis
+        """
+        if self.tumor is None and self.normal is None:
+            self.data_labels()
+        columns = self.rnaseq.data.columns
+        #When only one group was given, every other column belongs to the other group
+        if self.tumor is None:
+            normal = np.flatnonzero(columns.isin(self.normal))
+            tumor = np.setdiff1d(np.arange(len(columns)), normal)
+        elif self.normal is None:
+            tumor = np.flatnonzero(columns.isin(self.tumor))
+            normal = np.setdiff1d(np.arange(len(columns)), tumor)
+        else:
+            tumor = np.flatnonzero(columns.isin(self.tumor))
+            normal = np.flatnonzero(columns.isin(self.normal))
+        if len(tumor) == 0 or len(normal) == 0:
+            raise ValueError("%s has %d tumor and %d normal columns, both groups need samples (columns must be "
+                             "file uuids or TCGA barcodes to be labelled automatically)" % (self.name, len(tumor), len(normal)))
+
+        #The stored matrix is rewritten on every run so it always matches self.rnaseq.data
+        self.data_write()
+        return [(self.file, tumor, normal, start, min(start+chunk_size, len(self.rnaseq.data)), log)
+                for start in range(0, len(self.rnaseq.data), chunk_size)]
+
+    def data_results(self, chunks):
+        """
+        Assembles the statistics of every chunk into self.results, and adjusts the p-values
+        """
+        chunks = [statistics for start, statistics in sorted(chunks, key=lambda chunk: chunk[0])]
+        self.results = pd.DataFrame({key: np.concatenate([chunk[key] for chunk in chunks]) for key in chunks[0]},
+                                    index=self.rnaseq.data.index)
+        self.results['t_padj'] = bh_adjust(self.results['t_pvalue'].values)
+        self.results['u_padj'] = bh_adjust(self.results['u_pvalue'].values)
+
+    def data_test(self, workers=None, chunk_size=5000, log=True):
+        """
+        Runs the differential expression analysis
+        Inputs: workers = no. of processes (default: no. of cores), chunk_size = genes per task,
+        log = compare log2(x+1) transformed values
+        Output: self.results stores a pandas dataframe (gene x statistic)
+        """
+        de_batch([self], workers=workers, chunk_size=chunk_size, log=log)
+        return self.results
+
+def de_batch(analyses, workers=None, chunk_size=5000, log=True):
+    """
+    Runs the differential expression analysis of several projects as one batch on a single process pool
+    Input: list of gdc_de objects (e.g. one per project)
+    Output: the results of every analysis are stored in its self.results
+    """
+    tasks = [(analysis, analysis.data_chunks(chunk_size, log)) for analysis in analyses]
+    with ProcessPoolExecutor(workers) as pool:
+        futures = [(analysis, [pool.submit(de_chunk, *args) for args in chunks]) for analysis, chunks in tasks]
+        for analysis, chunks in futures:
+            analysis.data_results([future.result() for future in chunks])
+
+if __name__ == '__main__':
+
+    from query_rnaseq import gdc_rnaseq
+
+    lihc = gdc_rnaseq('LIHC')
+    lihc.read_csv()
+    de = gdc_de(lihc)
+    print(de.data_test().sort_values('t_padj').head())
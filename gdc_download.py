@@ -0,0 +1,110 @@
+import hashlib
+import requests
+import time
+import os
+
+data_endpt = "https://api.gdc.cancer.gov/data"
+
+#Errors of an interrupted transfer, after which the download is resumed
+interrupted = (requests.exceptions.ConnectionError,
+               requests.exceptions.ChunkedEncodingError,
+               requests.exceptions.Timeout)
+
+def file_md5(path, chunk_size=1<<20):
+    """
+    Computes the md5 of a file on disk
+    """
+    digest = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def download_file(url, path, md5=None, retries=5, chunk_size=1<<16, timeout=60):
+    """
+    Downloads a file to disk, resuming with HTTP Range requests after an interrupted transfer
+    The file is written to path + '.partial' and its md5 is computed while streaming, so verification
+    costs no extra pass; a mismatched file is downloaded again from the start.
+    Inputs: url of the file, path to write it to, md5 = expected md5 (not checked if None),
+    retries = max interruptions in a row without progress, or max md5 mismatches, chunk_size,
+    timeout = seconds per request
+    Output: path of the verified file
+    """
+    #A chunk cut short by a dropped connection is lost, so chunks are kept small to limit what is discarded
+    partial = path + ".partial"
+    digest = hashlib.md5()
+    #A partial file left by an earlier run is hashed once and resumed
+    if os.path.exists(partial):
+        with open(partial, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+
+    failures = 0
+    mismatches = 0
+    while True:
+        size = os.path.getsize(partial) if os.path.exists(partial) else 0
+        headers = {"Range": "bytes=%d-" % size} if size else {}
+        #Progress is measured against the partial file before the request, since a server ignoring the
+        #range restarts the file from zero
+        start = size
+        try:
+            with requests.get(url, headers=headers, stream=True, timeout=timeout) as response:
+                #416: the partial file already holds every byte of the file
+                if response.status_code != 416:
+                    response.raise_for_status()
+                    if size and response.status_code != 206:
+                        #The server ignored the range, start over
+                        size = 0
+                        digest = hashlib.md5()
+                    expected = size + int(response.headers["Content-Length"]) if "Content-Length" in response.headers else None
+                    with open(partial, 'ab' if size else 'wb') as f:
+                        for chunk in response.iter_content(chunk_size):
+                            f.write(chunk)
+                            digest.update(chunk)
+                    if expected is not None and os.path.getsize(partial) < expected:
+                        raise requests.exceptions.ChunkedEncodingError("connection closed after %d of %d bytes"
+                                                                       % (os.path.getsize(partial), expected))
+        except interrupted:
+            #Only consecutive interruptions without progress count towards the retries
+            if os.path.exists(partial) and os.path.getsize(partial) > start:
+                failures = 0
+            failures += 1
+            if failures > retries:
+                raise
+            time.sleep(min(2**failures, 30))
+            continue
+
+        if md5 and digest.hexdigest() != md5:
+            #Corrupted file, only this file is downloaded again
+            mismatches += 1
+            os.remove(partial)
+            digest = hashlib.md5()
+            if mismatches > retries:
+                raise IOError("md5 of %s does not match the manifest after %d attempts" % (path, mismatches))
+            continue
+
+        os.replace(partial, path)
+        return path
+
+def download_files(manifest, directory, endpoint=data_endpt, retries=5):
+    """
+    Downloads the files of a gdc manifest one at a time, skipping files that were already downloaded
+    Inputs: manifest = pandas dataframe with the id, filename and md5 columns of a gdc MANIFEST.txt,
+    directory to write the files to (as <directory>/<id>/<filename>, the layout of a gdc targz)
+    Output: list of the ids that could not be downloaded
+    """
+    failed = []
+    for file_id, file_name, md5 in zip(manifest['id'], manifest['filename'], manifest['md5']):
+        file_dir = os.path.join(directory, file_id)
+        if not os.path.exists(file_dir):
+            os.makedirs(file_dir)
+        path = os.path.join(file_dir, file_name)
+        #Completed files were verified when they were renamed from their partial file
+        if os.path.exists(path):
+            continue
+        try:
+            download_file(endpoint + "/" + file_id, path, md5=md5, retries=retries)
+        except (IOError, requests.exceptions.RequestException) as e:
+            print("failed to download " + file_id + ": " + str(e))
+            failed.append(file_id)
+    return failed
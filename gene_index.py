@@ -0,0 +1,144 @@
+import numpy as np
+import pandas as pd
+import os
+
+#GENCODE release used by the gdc harmonized (hg38) RNA-Seq, SNV and CNV pipelines
+gencode_gtf = "https://ftp.ebi.ac.uk/pub/databases/gencode/Gencode_human/release_22/gencode.v22.annotation.gtf.gz"
+
+#Index loaded by gene_index(), shared by every query object of the session
+index_cache = None
+
+def strip_version(ids):
+    """
+    Removes the version from Ensembl ids (ENSG00000000003.13 -> ENSG00000000003)
+    Input: array of Ensembl ids
+    Output: numpy array of version-stripped ids
+    """
+    return np.char.partition(np.asarray(ids, dtype=str), '.')[:, 0]
+
+def strip_chr(chrom):
+    """
+    Removes the 'chr' prefix of chromosome names, so that gtf (chr1) and segment (1) names agree
+    """
+    chrom = np.asarray(chrom, dtype=str)
+    return np.where(np.char.startswith(chrom, 'chr'), np.char.lstrip(chrom, 'chr'), chrom)
+
+def gene_index(gtf=gencode_gtf):
+    """
+    Returns the gene identifier index, loading it from disk (or building it from the gtf) on first use
+    """
+    global index_cache
+    if index_cache is None:
+        index_cache = gdc_gene_index(gtf)
+    return index_cache
+
+class gdc_gene_index:
+    """
+    Creates a gene identifier index harmonizing version-stripped Ensembl ids, gene symbols and gene
+    coordinates. Every identifier is stored as a sorted numpy array, so that mapping a whole column of
+    ids is a single vectorized searchsorted. The index is built once from a gtf and cached on disk.
+    Genes are numbered by their position in the sorted Ensembl id array, -1 marks an unknown id.
+    """
+
+    def __init__(self, gtf=gencode_gtf):
+        #Location of the cached index
+        self.main_dir = os.path.join(os.getcwd(),"data","GeneIndex")
+        self.file = os.path.join(self.main_dir,"gene_index.npz")
+
+        if not os.path.exists(self.file):
+            self.data_build(gtf)
+
+        with np.load(self.file) as index:
+            #Sorted, version-stripped Ensembl ids, with the symbol and coordinates of every gene
+            self.ensembl = index['ensembl']
+            self.symbol = index['symbol']
+            self.chrom = index['chrom']
+            self.start = index['start']
+            self.end = index['end']
+            #Sorted symbols and the gene each one belongs to
+            self.symbol_sorted = index['symbol_sorted']
+            self.symbol_genes = index['symbol_genes']
+
+    def data_build(self, gtf=gencode_gtf):
+        """
+        Builds the index from the gene records of a gtf file (local path or url) and saves it to disk
+        Input: gtf = location of the gtf, default the GENCODE v22 annotation used by the gdc
+        Output: self.file stores the index arrays
+        """
+        #Create a path to save the index if it doesnt exist already
+        if not os.path.exists(self.main_dir):
+            os.makedirs(self.main_dir)
+
+        genes = pd.read_table(gtf, sep="\t", comment="#", header=None, usecols=[0,2,3,4,8],
+                              names=['chrom','feature','start','end','attributes'])
+        genes = genes[genes.feature == 'gene']
+        genes['ensembl'] = strip_version(genes.attributes.str.extract(r'gene_id "([^"]+)"')[0].values)
+        genes['symbol'] = genes.attributes.str.extract(r'gene_name "([^"]+)"')[0].fillna('')
+        #Keep a single record for genes present on both sex chromosomes
+        genes = genes.sort_values('ensembl', kind='stable').drop_duplicates('ensembl')
+
+        symbol = np.asarray(genes.symbol.values, dtype=str)
+        symbol_genes = np.argsort(symbol, kind='stable')
+        np.savez(self.file,
+                 ensembl=np.asarray(genes.ensembl.values, dtype=str),
+                 symbol=symbol,
+                 chrom=strip_chr(genes.chrom.values),
+                 start=genes.start.values.astype(np.int64),
+                 end=genes.end.values.astype(np.int64),
+                 symbol_sorted=symbol[symbol_genes],
+                 symbol_genes=symbol_genes)
+
+    @staticmethod
+    def _lookup(keys, genes, query):
+        #Position of every query in the sorted keys, -1 when the query is not a key
+        if len(query) == 0:
+            return np.empty(0, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(keys, query), len(keys)-1)
+        found = keys[pos] == query
+        return np.where(found, pos if genes is None else genes[pos], -1)
+
+    def from_ensembl(self, ids):
+        """
+        Maps Ensembl ids (versioned or not) to gene numbers, -1 for unknown ids
+        """
+        return self._lookup(self.ensembl, None, strip_version(ids))
+
+    def from_symbol(self, symbols):
+        """
+        Maps gene symbols to gene numbers, -1 for unknown symbols
+        """
+        return self._lookup(self.symbol_sorted, self.symbol_genes, np.asarray(symbols, dtype=str))
+
+    def to_symbol(self, ids):
+        """
+        Maps Ensembl ids (versioned or not) to gene symbols, '' for unknown ids
+        """
+        genes = self.from_ensembl(ids)
+        return np.where(genes >= 0, self.symbol[genes], '')
+
+    def to_ensembl(self, symbols):
+        """
+        Maps gene symbols to version-stripped Ensembl ids, '' for unknown symbols
+        """
+        genes = self.from_symbol(symbols)
+        return np.where(genes >= 0, self.ensembl[genes], '')
+
+    def segment_genes(self, chrom, start, end):
+        """
+        Assigns every gene to the segment containing its midpoint
+        Inputs: chromosome, start and end arrays of non-overlapping segments (e.g. a cnv.seg file)
+        Output: array of the segment index of every gene, -1 for genes outside all segments
+        """
+        chrom = strip_chr(chrom)
+        #Chromosome and position are combined into a single sortable key
+        names = np.union1d(self.chrom, chrom)
+        offset = np.int64(1) << 32
+        seg_chrom = np.searchsorted(names, chrom).astype(np.int64) * offset
+        seg_start = seg_chrom + np.asarray(start, dtype=np.int64)
+        seg_end = seg_chrom + np.asarray(end, dtype=np.int64)
+        gene_mid = (np.searchsorted(names, self.chrom).astype(np.int64) * offset + (self.start + self.end) // 2)
+
+        order = np.argsort(seg_start, kind='stable')
+        pos = np.searchsorted(seg_start[order], gene_mid, side='right') - 1
+        inside = (pos >= 0) & (gene_mid <= seg_end[order][np.maximum(pos, 0)])
+        return np.where(inside, order[np.maximum(pos, 0)], -1)
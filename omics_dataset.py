@@ -0,0 +1,279 @@
+import numpy as np
+import pandas as pd
+import requests
+import json
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+#Generates a folder to store the data portal gene expression data if none exits
+newpath = os.path.join(os.getcwd(),"data")
+if not os.path.exists(newpath):
+    os.makedirs(newpath)
+
+#Length of the TCGA barcode identifying a patient (TCGA-XX-XXXX) or a sample (TCGA-XX-XXXX-01A)
+barcode_len = {'patient': 12, 'sample': 16}
+
+def file_barcodes(file_ids):
+    """
+    Maps gdc file uuids to the sample barcodes of the cases they were generated from
+    Input: list of file uuids (e.g. the columns of gdc_rnaseq.data)
+    Output: dictionary of file uuid to sample barcode
+    """
+    files_endpt = "https://api.gdc.cancer.gov/files"
+
+    filters = {
+        "op": "in",
+        "content":{
+            "field": "files.file_id",
+            "value": list(file_ids)
+            }
+        }
+
+    params = {
+        "filters": filters,
+        "fields": "file_id,cases.samples.submitter_id",
+        "format": "JSON",
+        "size": len(file_ids)
+        }
+
+    #A POST is used since the list of file uuids can be too long for a GET
+    response = requests.post(files_endpt, data = json.dumps(params), headers = {"Content-Type": "application/json"})
+
+    barcodes = {}
+    for file_entry in json.loads(response.content.decode("utf-8"))["data"]["hits"]:
+        barcodes[file_entry["file_id"]] = file_entry["cases"][0]["samples"][0]["submitter_id"]
+    return barcodes
+
+class gdc_dataset:
+    """
+    Creates data objects that align several omics matrices (gdc_rnaseq, gdc_mirna, gene level cnv, ...)
+    and clinical labels on the patient or sample barcode, store them as float32 memory mapped matrices
+    (sample x feature), and yield shuffled minibatches as views into the stores.
+    Samples are written in a random order, so a shuffled minibatch is a contiguous slice of every store
+    and training never needs the full multi-omic matrix in RAM.
+    """
+
+    def __init__(self, name, level='sample'):
+        #Name of the dataset, and the barcode level the omics are aligned on ('patient' or 'sample')
+        self.name = name
+        self.level = level
+        #Initialize the omics matrices (feature x barcode) to align, and the clinical labels (barcode)
+        self.omics = {}
+        self.labels = pd.Series(dtype=float)
+        #Folder to store the dataset
+        self.main_dir = os.path.join(os.getcwd(),"data","Dataset")
+        self.query_dir = os.path.join(self.main_dir,self.name)
+        #Initialize the memory mapped stores (sample x feature) and the aligned barcodes
+        self.data = {}
+        self.y = np.empty(0)
+        self.samples = pd.Index([])
+        self.features = {}
+        #Number of samples in the training set, the rest are the test set
+        self.n_train = 0
+
+    def data_add(self, omic, data):
+        """
+        Adds an omics matrix to the dataset
+        Inputs: omic = name of the omics type ('rnaseq', 'mirna', 'cnv', ...), data = gdc query object
+        with a loaded .data, or a pandas dataframe (feature x file uuid or barcode)
+        """
+        if hasattr(data, 'data'):
+            data = data.data
+        #Columns named by gdc file uuids are mapped to their sample barcodes
+        if not str(data.columns[0]).startswith('TCGA-'):
+            barcodes = file_barcodes(data.columns)
+            unmapped = [column for column in data.columns if column not in barcodes]
+            if unmapped:
+                print("warning: %d %s columns could not be mapped to barcodes and are dropped: %s"
+                      % (len(unmapped), omic, ", ".join(map(str, unmapped[:5])) + (" ..." if len(unmapped) > 5 else "")))
+            data = data.loc[:, data.columns.isin(list(barcodes))].rename(columns=barcodes)
+        data = data.set_axis([x[:barcode_len[self.level]] for x in data.columns], axis=1)
+        #Keep the first file of any barcode with several files
+        self.omics[omic] = data.loc[:, ~data.columns.duplicated()]
+
+    def labels_add(self, labels):
+        """
+        Adds clinical labels to the dataset
+        Input: pandas series of labels (e.g. sample_type) indexed by patient or sample barcode
+        """
+        labels = labels.copy()
+        labels.index = [x[:barcode_len[self.level]] for x in labels.index]
+        self.labels = labels[~labels.index.duplicated()]
+
+    def data_write(self, test_size=0.3, seed=415):
+        """
+        Aligns the omics and labels on their shared barcodes, and writes them in a random sample order
+        to memory mapped stores in the query directory
+        Inputs: test_size = fraction of samples held out as the test set, seed = random seed of the order
+        Output: <omic>.npy (sample x feature, float32), labels.npy and the barcode/feature indexes
+        """
+        if not self.omics:
+            print('No omics have been added, run method self.data_add')
+            return
+
+        #Create a path for this dataset if it doesnt exist already
+        if not os.path.exists(self.query_dir):
+            os.makedirs(self.query_dir)
+
+        #Barcodes present in every omics matrix (and in the labels, if any were added)
+        samples = None
+        for data in self.omics.values():
+            samples = data.columns if samples is None else samples.intersection(data.columns)
+        if not self.labels.empty:
+            samples = samples.intersection(self.labels.index)
+        if len(samples) == 0:
+            raise ValueError("the omics %s%s share no %s barcodes, nothing to write"
+                             % (", ".join(self.omics), " and the labels" if not self.labels.empty else "", self.level))
+        samples = samples[np.random.RandomState(seed).permutation(len(samples))]
+
+        for omic, data in self.omics.items():
+            store = np.lib.format.open_memmap(os.path.join(self.query_dir,omic+".npy"), mode='w+',
+                                              dtype=np.float32, shape=(len(samples), data.shape[0]))
+            #Write one sample at a time so that only one copy of the omics matrix is held in RAM
+            for i, sample in enumerate(samples):
+                store[i] = data[sample].values
+            store.flush()
+            del store
+            pd.Series(data.index, name='feature').to_csv(os.path.join(self.query_dir,"features_"+omic+".csv"), index=False)
+
+        if not self.labels.empty:
+            np.save(os.path.join(self.query_dir,"labels.npy"), self.labels[samples].values)
+        pd.Series(samples, name='barcode').to_csv(os.path.join(self.query_dir,"samples.csv"), index=False)
+
+        self.n_train = len(samples) - int(round(test_size*len(samples)))
+        with open(os.path.join(self.query_dir,"dataset.json"), "w") as f:
+            json.dump({"omics": list(self.omics), "level": self.level, "n_train": self.n_train}, f)
+
+        self.data_load()
+
+    def data_load(self):
+        """
+        Opens the memory mapped stores of a previously written dataset
+        Output: self.data stores a dictionary of omic to memory mapped matrix (sample x feature),
+        self.y the labels and self.samples the barcodes, in storage order
+        """
+        meta_file = os.path.join(self.query_dir,"dataset.json")
+        if not os.path.exists(meta_file):
+            print("dataset does not exist, run method self.data_write")
+            return
+
+        with open(meta_file) as f:
+            meta = json.load(f)
+        self.level = meta["level"]
+        self.n_train = meta["n_train"]
+
+        self.data = {omic: np.load(os.path.join(self.query_dir,omic+".npy"), mmap_mode='r') for omic in meta["omics"]}
+        self.features = {omic: pd.read_csv(os.path.join(self.query_dir,"features_"+omic+".csv"))['feature'].values
+                         for omic in meta["omics"]}
+        self.samples = pd.Index(pd.read_csv(os.path.join(self.query_dir,"samples.csv"))['barcode'])
+        labels_file = os.path.join(self.query_dir,"labels.npy")
+        #The labels are small and may be strings, so they are read into memory rather than memory mapped
+        self.y = np.load(labels_file, allow_pickle=True) if os.path.exists(labels_file) else np.empty(0)
+
+    def data_shuffle(self, seed=None, chunk_size=1024):
+        """
+        Rewrites the stores in a new random sample order, within the training and the test set, so that
+        later epochs see minibatches of different samples
+        Inputs: seed = random seed of the order, chunk_size = samples copied at a time
+        Output: the stores, labels and barcodes of the query directory are reordered and reloaded
+        """
+        if not self.data:
+            self.data_load()
+
+        n = len(self.samples)
+        rng = np.random.RandomState(seed)
+        order = np.concatenate([rng.permutation(self.n_train), self.n_train + rng.permutation(n - self.n_train)])
+
+        for omic, store in self.data.items():
+            path = os.path.join(self.query_dir,omic+".npy")
+            out = np.lib.format.open_memmap(path+".tmp", mode='w+', dtype=store.dtype, shape=store.shape)
+            #Copy a chunk of samples at a time so that the store is never read into RAM at once
+            for start in range(0, n, chunk_size):
+                out[start:start+chunk_size] = store[order[start:start+chunk_size]]
+            out.flush()
+            del out
+            os.replace(path+".tmp", path)
+
+        if len(self.y):
+            np.save(os.path.join(self.query_dir,"labels.npy"), self.y[order])
+        pd.Series(self.samples[order], name='barcode').to_csv(os.path.join(self.query_dir,"samples.csv"), index=False)
+
+        self.data = {}
+        self.data_load()
+
+    def batches(self, batch_size=32, subset='train', shuffle=True, prefetch=0, threads=1, seed=None):
+        """
+        Yields minibatches of the dataset as views into the memory mapped stores
+        Minibatches are contiguous runs of the sample order written by data_write. With shuffle, every call
+        (epoch) shifts the minibatch boundaries by a random offset and shuffles the order of the minibatches,
+        but a sample's neighbours stay the same until the stores are reordered with self.data_shuffle.
+        Inputs: batch_size, subset = 'train', 'test' or None for all samples, shuffle = shuffle the order
+        of the minibatches, prefetch = no. of minibatches read ahead by background threads (0 disables),
+        threads = no. of prefetch threads, seed = random seed of the minibatch order
+        Output: (dictionary of omic to sample x feature view, labels view) for every minibatch
+        """
+        if not self.data:
+            self.data_load()
+
+        n = len(self.samples)
+        first, last = {'train': (0, self.n_train), 'test': (self.n_train, n), None: (0, n)}[subset]
+        starts = np.arange(first, last, batch_size)
+        if shuffle:
+            rng = np.random.RandomState(seed)
+            #A random offset moves the minibatch boundaries, the first minibatch holds the samples before it
+            offset = rng.randint(batch_size) if last - first > batch_size else 0
+            starts = np.arange(first+offset, last, batch_size)
+            if offset:
+                starts = np.append(first, starts)
+            rng.shuffle(starts)
+
+        #Minibatches end at the next boundary, which is not start + batch_size for the offset first minibatch
+        bounds = np.append(np.sort(starts), last)
+        stops = dict(zip(bounds[:-1], bounds[1:]))
+        views = (self._batch(start, stops[start]) for start in starts)
+        if not prefetch:
+            yield from views
+            return
+
+        #Background threads fault the pages of the upcoming minibatches into memory while the current
+        #one is being trained on
+        with ThreadPoolExecutor(threads) as pool:
+            window = deque()
+            for view in views:
+                window.append(pool.submit(self._touch, view))
+                if len(window) > prefetch:
+                    yield window.popleft().result()
+            while window:
+                yield window.popleft().result()
+
+    def _batch(self, start, stop):
+        #Slicing a contiguous range of samples returns views, nothing is copied
+        y = self.y[start:stop] if len(self.y) else None
+        return {omic: store[start:stop] for omic, store in self.data.items()}, y
+
+    @staticmethod
+    def _touch(view):
+        #Read one element of every page of the minibatch so it is resident before it is used
+        x, y = view
+        for store in x.values():
+            flat = store.reshape(-1)
+            flat[::max(1, 4096 // flat.itemsize)].sum()
+        return view
+
+if __name__ == '__main__':
+
+    from query_rnaseq import gdc_rnaseq
+    from query_mirna import gdc_mirna
+
+    rnaseq = gdc_rnaseq('LIHC')
+    rnaseq.read_csv()
+    mirna = gdc_mirna('LIHC')
+    mirna.data_read()
+
+    lihc = gdc_dataset('LIHC')
+    lihc.data_add('rnaseq', rnaseq)
+    lihc.data_add('mirna', mirna)
+    lihc.data_write()
+    for x, y in lihc.batches(batch_size=64, prefetch=2):
+        print({omic: v.shape for omic, v in x.items()})
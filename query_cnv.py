@@ -8,6 +8,7 @@ from io import StringIO
 from io import BytesIO
 import tarfile
 import sqlite3
+from gene_index import gene_index
 
 allowed_cns = ['cnv.seg','nocnv.seg']
 
@@ -42,6 +43,8 @@ class gdc_cnv:
         self.manifest = ''
         #Initialize location of data csv file
         self.file = ''
+        #Initialize gene level copy number matrix
+        self.data = pd.DataFrame()
 
     def data_query(self):
         """
@@ -146,6 +149,25 @@ class gdc_cnv:
                         if_exists='append'
                     )
 
+    def data_genes(self):
+        """
+        Generates a gene level copy number matrix from the segments stored in the sql database,
+        every gene takes the Segment_Mean of the segment containing its midpoint
+        Input: self.conn populated by self.data_read
+        Output: self.data stores a pandas dataframe (Ensembl id x sample id), NaN for genes outside all segments
+        """
+        index = gene_index()
+
+        tables = [row[0] for row in self.sql.execute("SELECT name FROM sqlite_master WHERE type='table'")]
+        data = np.full((len(index.ensembl), len(tables)), np.nan)
+        for i, table in enumerate(tables):
+            segments = pd.read_sql('SELECT Chromosome, Start, End, Segment_Mean FROM ' + "'" + table + "'", self.conn)
+            genes = index.segment_genes(segments.Chromosome.values, segments.Start.values, segments.End.values)
+            data[genes >= 0, i] = segments.Segment_Mean.values[genes[genes >= 0]]
+
+        self.data = pd.DataFrame(data, index=index.ensembl, columns=tables)
+        self.data.index.name = 'Ensembl_ID'
+
 if __name__ == '__main__':
 
     #Make the query object, while initializing the cancer type and the number of examples
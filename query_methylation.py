@@ -0,0 +1,239 @@
+import numpy as np
+import pandas as pd
+import requests
+import json
+import re
+import os
+import tarfile
+from io import BytesIO
+
+#Generates a folder to store the data portal gene expression data if none exits
+newpath = os.path.join(os.getcwd(),"data")
+if not os.path.exists(newpath):
+    os.makedirs(newpath)
+
+#Columns of a HumanMethylation450 level 3 file holding the probe id and the beta value of the sample
+probe_col = 'Composite Element REF'
+beta_col = 'Beta_value'
+
+class gdc_methylation:
+    '''
+    Creates data objects that can query the gdc data portal for HumanMethylation450 beta values,
+    and store them on disk as a float32 memory mapped matrix (probe x sample_id) with the probe
+    annotation stored once alongside it. Probes can then be loaded by chromosome or gene without
+    reading the whole matrix.
+    '''
+
+    def __init__(self, name):
+        #Initialize the type of cancer for the database query and the size of query
+        self.name = name
+        #Initialize beta value data matrix
+        self.data = pd.DataFrame()
+        #Initialize empty probe annotation matrix (Chromosome, Start, End, Gene_Symbol, ...)
+        self.probes = pd.DataFrame()
+        #Initialize the location for the data directory
+        self.main_dir = os.path.join(os.getcwd(),"data","Methylation")
+        self.query_dir = os.path.join(self.main_dir,self.name)
+        #Initialize location of the beta matrix, probe annotation and sample ids
+        self.file = os.path.join(self.query_dir,self.name+"_beta.npy")
+        self.probe_file = os.path.join(self.query_dir,self.name+"_probes.csv")
+        self.sample_file = os.path.join(self.query_dir,self.name+"_samples.csv")
+        #Initialize an empty http reponse
+        self.response = ''
+        #Initialize variable for size of query
+        self.size = ''
+
+    def data_files(self):
+        '''
+        Performs a query of the NCI genomic portal files endpoint given a type of cancer.
+        Ex. Type: Hepatocellular Carcinoma - LIHC
+        Name followed by no. of samples desired. Ex. LIHC10 returns beta values for first 10 samples
+        Returns the list of file uuids matching the query
+        '''
+
+        files_endpt = "https://api.gdc.cancer.gov/files"
+
+        #Parse name for type of cancer and desired number of samples integer
+        cancer = re.search(r'\D+', self.name).group(0)
+        size = re.search(r'\d+', self.name)
+        if size:
+            size = size.group(0)
+        else:
+            size = 2000
+
+        #Filters for the query, recieving all HumanMethylation450 beta value files for a specific cancer
+        filters = {
+            "op": "and",
+            "content":[
+                {
+                "op": "in",
+                "content":{
+                    "field": "cases.project.project_id",
+                    "value": ["TCGA-"+cancer]
+                    }
+                },
+                {
+                "op": "in",
+                "content":{
+                    "field": "files.data_type",
+                    "value": ["Methylation Beta Value"]
+                    }
+                },
+                {
+                "op": "in",
+                "content":{
+                    "field": "files.platform",
+                    "value": ["Illumina Human Methylation 450"]
+                    }
+                }
+            ]
+        }
+
+        # Here a GET is used, so the filter parameters should be passed as a JSON string.
+        params = {
+            "filters": json.dumps(filters),
+            "fields": "file_id",
+            "format": "JSON",
+            "size": size
+            }
+
+        response = requests.get(files_endpt, params = params)
+        file_uuid_list = []
+
+        # This step populates the download list with the file_ids from the previous query
+        for file_entry in json.loads(response.content.decode("utf-8"))["data"]["hits"]:
+            file_uuid_list.append(file_entry["file_id"])
+
+        return file_uuid_list
+
+    def data_query(self):
+        """
+        Requests the files returned by self.data_files from the NCI genomic portal
+        Output: Streaming response of the compressed tar.gz file as self.response, read by self.data_read
+        without holding the targz in memory
+        """
+        file_uuid_list = self.data_files()
+
+        data_endpt = "https://api.gdc.cancer.gov/data"
+
+        params = {"ids": file_uuid_list}
+        #Acquire memory location of compressed data from the data portal
+        self.response = requests.post(data_endpt, data = json.dumps(params), headers = {"Content-Type": "application/json"},
+                                      stream = True)
+        self.response.raise_for_status()
+
+    def data_read(self, chunk_size=16384):
+        """
+        Extracts and parses the queried files into a float32 memory mapped beta matrix on disk
+        The targz is streamed from the response one member at a time, and every sample is appended to a
+        sample-major temporary file, which is transposed into the matrix a block of probes at a time.
+        Input: self.response (streaming), chunk_size = probes transposed at a time
+        Output: self.file stores the beta matrix (probe x sample, NaN kept), self.probe_file the probe
+        annotation and self.sample_file the sample ids
+        """
+        #Run query if server response is empty
+        if not self.response:
+            self.data_query()
+
+        #Create a path for this query if it doesnt exist already
+        if not os.path.exists(self.query_dir):
+            os.makedirs(self.query_dir)
+
+        by_sample_file = self.file + ".samples"
+        samples = []
+        probes = None
+        with tarfile.open(fileobj=self.response.raw, mode='r|gz') as tar, open(by_sample_file, 'wb') as by_sample:
+            for member in tar:
+                #Skip the MANIFEST.txt and the folder entries of the targz file
+                if not member.isfile() or '/' not in member.name:
+                    continue
+                content = tar.extractfile(member).read()
+
+                if probes is None:
+                    #The annotation is read once from the first file, with the probes ordered by position so
+                    #that every chromosome is a contiguous block of rows in the matrix
+                    probes = pd.read_table(BytesIO(content),sep="\t")
+                    probes = probes.drop(columns=beta_col).sort_values(['Chromosome','Start'],kind='stable')
+                    order = probes.index.values
+                    probe_ids = probes[probe_col].values
+                    first_ids = None
+
+                #Only the probe id and beta value columns are parsed for every sample
+                df = pd.read_table(BytesIO(content),sep="\t",usecols=[probe_col,beta_col],dtype={beta_col: np.float32})
+                ids = df[probe_col].values
+                if first_ids is None:
+                    first_ids = ids
+                #Files sharing the probe order of the first file are reordered by position directly,
+                #any other file is aligned on the probe ids
+                if len(ids) == len(first_ids) and (ids == first_ids).all():
+                    values = df[beta_col].values[order]
+                else:
+                    values = df.set_index(probe_col)[beta_col].reindex(probe_ids).values
+                by_sample.write(np.ascontiguousarray(values, dtype=np.float32).tobytes())
+                samples.append(member.name.split('/')[0])
+
+        if probes is None:
+            os.remove(by_sample_file)
+            print('The query returned no methylation files')
+            return
+
+        #Transpose into the probe x sample matrix, every page of the matrix is written once
+        by_sample = np.memmap(by_sample_file, dtype=np.float32, mode='r', shape=(len(samples), len(probes)))
+        beta = np.lib.format.open_memmap(self.file, mode='w+', dtype=np.float32, shape=(len(probes), len(samples)))
+        for start in range(0, len(probes), chunk_size):
+            beta[start:start+chunk_size] = by_sample[:, start:start+chunk_size].T
+        beta.flush()
+        del beta, by_sample
+        os.remove(by_sample_file)
+
+        probes.reset_index(drop=True).to_csv(self.probe_file, index_label='row')
+        pd.Series(samples, name='sample_id').to_csv(self.sample_file, index=False)
+        self.probes = probes.reset_index(drop=True)
+        self.size = (len(probes), len(samples)) #Store the dimensions of the data matrix
+
+    def data_load(self, chromosome=None, gene=None):
+        """
+        Loads beta values from the memory mapped matrix, reading only the selected probes
+        Inputs: chromosome = 'chr1' or list of chromosomes, gene = 'GSTP1' or list of gene symbols
+        (all probes if neither is given)
+        Output: self.data stores a pandas dataframe (probe x sample id) of float32 beta values
+        """
+        if not os.path.exists(self.file):
+            print('Beta matrix does not exist, run method self.data_read')
+            return
+
+        #The probe annotation is small compared to the matrix, and is kept on the object once read
+        if self.probes.empty:
+            self.probes = pd.read_csv(self.probe_file, index_col=0)
+        samples = pd.read_csv(self.sample_file)['sample_id'].values
+
+        mask = np.ones(len(self.probes), dtype=bool)
+        if chromosome is not None:
+            chromosome = [chromosome] if isinstance(chromosome, str) else list(chromosome)
+            mask &= self.probes['Chromosome'].isin(chromosome).values
+        if gene is not None:
+            gene = [gene] if isinstance(gene, str) else list(gene)
+            #Gene_Symbol holds a ';' separated symbol for every transcript the probe maps to
+            symbols = self.probes['Gene_Symbol'].str.split(';').explode()
+            mask &= np.isin(np.arange(len(self.probes)), symbols.index[symbols.isin(gene)])
+        rows = np.flatnonzero(mask)
+
+        beta = np.load(self.file, mmap_mode='r')
+        if len(rows) and rows[-1] - rows[0] + 1 == len(rows):
+            #A contiguous block of probes (e.g. a chromosome) is read as a single slice
+            values = np.array(beta[rows[0]:rows[-1]+1])
+        else:
+            values = beta[rows]
+
+        self.data = pd.DataFrame(values, index=self.probes[probe_col].values[rows], columns=samples)
+        #Set index name
+        self.data.index.name = 'Probe_ID'
+        self.size = self.data.shape
+
+#Debugging and testing
+if __name__ == "__main__":
+
+    LIHC = gdc_methylation("LIHC5")
+    LIHC.data_read()
+    LIHC.data_load(chromosome="chr1")
+    print(LIHC.data.shape)
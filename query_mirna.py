@@ -6,6 +6,8 @@ import os
 import re
 from io import StringIO
 from io import BytesIO
+from query_pipeline import gdc_pipeline
+from cohort_cache import cohort_cache
 import tarfile
 
 #Generates a folder to store the data portal gene expression data if none exits
@@ -33,14 +35,18 @@ class gdc_mirna:
         self.file = ''
         #Initialize index
         self.index = ''
+        #Initialize the stage utilization of the last pipelined read
+        self.stats = {}
+        #Initialize the shared memory cache self.data was loaded from, if any
+        self.cache = None
 
-    def data_query(self):
+    def data_files(self):
         """
-        Performs a query of the NCI genomic portal given a type of cancer initialized with the class.
+        Performs a query of the NCI genomic portal files endpoint given a type of cancer initialized with the class.
         Ex. Type: Hepatocellular Carcinoma - LIHC
         Input: self.name followed by no. of samples desired. Ex. LIHC10 returns gene expression for
         first 10 samples. If specific number not present, will return all samples in database.
-        Output: Binary data file of compressed tar.gz file in memory
+        Output: List of file uuids matching the query
         """
         files_endpt = "https://api.gdc.cancer.gov/files"
 
@@ -97,6 +103,15 @@ class gdc_mirna:
         for file_entry in json.loads(response.content.decode("utf-8"))["data"]["hits"]:
             file_uuid_list.append(file_entry["file_id"])
 
+        return file_uuid_list
+
+    def data_query(self):
+        """
+        Downloads the files returned by self.data_files from the NCI genomic portal
+        Output: Binary data file of compressed tar.gz file in memory
+        """
+        file_uuid_list = self.data_files()
+
         data_endpt = "https://api.gdc.cancer.gov/data"
 
         params = {"ids": file_uuid_list}
@@ -129,6 +144,46 @@ class gdc_mirna:
                 #Set index name
                 self.data.index.name = 'miRNA_ID'
 
+    def data_read_pipelined(self, producers=4, parsers=None, batch_size=10, queue_size=8):
+        """
+        Pipelined alternative to data_read, overlapping the download, decompression and parsing of the
+        queried files (see query_pipeline.gdc_pipeline)
+        Inputs: producers = concurrent downloads, parsers = parser processes (default: no. of cores),
+        batch_size = files per download, queue_size = max batches held in memory
+        Output: self.data stores a pandas dataframe (mirna x sample id),
+        self.stats stores the utilization of every stage
+        """
+        pipeline = gdc_pipeline(self.data_files(), "mirna", producers=producers, parsers=parsers,
+                                batch_size=batch_size, queue_size=queue_size)
+        self.data = pipeline.run()
+        #Set index name
+        self.data.index.name = 'miRNA_ID'
+        self.stats = pipeline.stats
+
+    def data_cached(self, cache=None):
+        """
+        Loads self.data from a shared memory cache, so that parallel worker processes share one copy
+        of the matrix. The first process loads it by reading the query and publishes it.
+        Input: cache = gdc_cache object (default: the cache of the process, see cohort_cache.cohort_cache)
+        Output: self.data stores a read only pandas dataframe backed by shared memory
+        """
+        self.cache = cache or cohort_cache()
+
+        def loader():
+            self.data_read()
+            return self.data
+
+        self.data = self.cache.data_load(os.path.join("miRNA",self.name), loader)
+
+    def data_release(self):
+        """
+        Releases the reference of this object to the cached matrix loaded by self.data_cached
+        """
+        if self.cache is not None:
+            self.cache.data_release(os.path.join("miRNA",self.name))
+            self.cache = None
+            self.data = pd.DataFrame()
+
     def data_save(self, safe=True, format="csv"):
         """
         Saves loaded data as a csv, txt or in parquet format
@@ -0,0 +1,186 @@
+import numpy as np
+import pandas as pd
+import requests
+import asyncio
+import json
+import re
+import gzip
+import tarfile
+import time
+import os
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor
+
+data_endpt = "https://api.gdc.cancer.gov/data"
+
+def parse_rnaseq(content):
+    """
+    Parses a single HTSeq - Counts file
+    Input: bytes of a (gzipped) counts file
+    Output: (gene ids, counts) numpy arrays
+    """
+    #Counts files are gzipped inside the targz, decompress when the gzip magic number is present
+    if content[:2] == b'\x1f\x8b':
+        content = gzip.decompress(content)
+    df = pd.read_table(BytesIO(content),sep="\t",header=None)
+    return df[0].values, df[1].values
+
+def parse_mirna(content):
+    """
+    Parses a single miRNA Expression Quantification file
+    Input: bytes of a miRNA quantification txt file
+    Output: (mirna ids, read counts) numpy arrays
+    """
+    df = pd.read_table(BytesIO(content),sep="\t",usecols=['miRNA_ID','read_count'])
+    return df['miRNA_ID'].values, df['read_count'].values
+
+#Parsers available to the pipeline, keyed by the type of data being read
+parsers = {'rnaseq': parse_rnaseq, 'mirna': parse_mirna}
+
+def fetch_batch(ids):
+    """
+    Downloads a batch of files from the data endpoint
+    Input: list of file uuids
+    Output: (bytes of the response, True if the response is a targz)
+    """
+    response = requests.post(data_endpt, data = json.dumps({"ids": ids}), headers = {"Content-Type": "application/json"})
+    response.raise_for_status()
+    #The portal returns a targz for several ids, and the bare file for a single id
+    file_name = re.findall("filename=(.+)", response.headers["Content-Disposition"])[0]
+    return response.content, file_name.endswith("tar.gz")
+
+def parse_batch(kind, ids, content, is_tar):
+    """
+    Decompresses and parses every member of a downloaded batch, runs in a parser process
+    Input: kind of data, file uuids of the batch, response bytes, is_tar
+    Output: list of (file uuid, index, values), and the seconds spent parsing
+    """
+    t0 = time.time()
+    parser = parsers[kind]
+    results = []
+    if is_tar:
+        with tarfile.open(fileobj=BytesIO(content)) as tar:
+            for member in tar.getmembers():
+                #Skip the MANIFEST.txt and the folder entries of the targz file
+                if not member.isfile() or '/' not in member.name:
+                    continue
+                results.append((member.name.split('/')[0],) + parser(tar.extractfile(member).read()))
+    else:
+        results.append((ids[0],) + parser(content))
+
+    return results, time.time() - t0
+
+class gdc_pipeline:
+    """
+    Reads a list of gdc files into a pandas dataframe (gene x file_id) by overlapping the download,
+    decompression and parsing of the files.
+    Async producers download batches of files into a bounded queue, a process pool decompresses and
+    parses the batches, and a single assembler writes the parsed batches into the matrix in order.
+    """
+
+    def __init__(self, file_ids, kind, producers=4, parsers=None, batch_size=10, queue_size=8):
+        #File uuids to read, and the type of data to parse them as ('rnaseq' or 'mirna')
+        self.file_ids = list(file_ids)
+        self.kind = kind
+        #Number of concurrent downloads and parser processes
+        self.producers = producers
+        self.parsers = parsers or os.cpu_count() or 1
+        #Number of files requested per download
+        self.batch_size = batch_size
+        #Maximum number of batches held in memory (downloaded or parsed, but not yet assembled)
+        self.queue_size = queue_size
+        #Initialize the utilization statistics of the last run
+        self.stats = {}
+
+    def run(self):
+        """
+        Runs the pipeline
+        Output: pandas dataframe (gene x file_id), self.stats stores the per stage utilization
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self._run())
+
+        #An event loop is already running (e.g. in a notebook), run the pipeline in its own thread
+        with ThreadPoolExecutor(1) as executor:
+            return executor.submit(asyncio.run, self._run()).result()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        batches = [self.file_ids[i:i+self.batch_size] for i in range(0, len(self.file_ids), self.batch_size)]
+        #Position of every file in the columns of the matrix
+        position = {file_id: i for i, file_id in enumerate(self.file_ids)}
+
+        #Batches are handed out in order, so the batch the assembler waits on always holds a slot
+        todo = asyncio.Queue()
+        for n in range(len(batches)):
+            todo.put_nowait(n)
+        slots = asyncio.Semaphore(self.queue_size)
+        downloaded = asyncio.Queue(maxsize=self.queue_size)
+        parsed = [loop.create_future() for _ in batches]
+
+        busy = {'download': 0.0, 'parse': 0.0, 'assemble': 0.0}
+        self.stats = {'queue_peak': 0}
+
+        async def produce(http_pool):
+            while not todo.empty():
+                n = todo.get_nowait()
+                await slots.acquire()
+                t0 = time.time()
+                try:
+                    content, is_tar = await loop.run_in_executor(http_pool, fetch_batch, batches[n])
+                except Exception as e:
+                    parsed[n].set_exception(e)
+                    return
+                busy['download'] += time.time() - t0
+                await downloaded.put((n, content, is_tar))
+                self.stats['queue_peak'] = max(self.stats['queue_peak'], downloaded.qsize())
+
+        async def parse(parse_pool):
+            while True:
+                n, content, is_tar = await downloaded.get()
+                try:
+                    results, seconds = await loop.run_in_executor(parse_pool, parse_batch, self.kind, batches[n], content, is_tar)
+                except Exception as e:
+                    parsed[n].set_exception(e)
+                    continue
+                busy['parse'] += seconds
+                parsed[n].set_result(results)
+
+        t_start = time.time()
+        data = None
+        index = None
+        with ThreadPoolExecutor(self.producers) as http_pool, ProcessPoolExecutor(self.parsers) as parse_pool:
+            tasks = [asyncio.ensure_future(produce(http_pool)) for _ in range(self.producers)]
+            tasks += [asyncio.ensure_future(parse(parse_pool)) for _ in range(self.parsers)]
+            try:
+                #Assemble the parsed batches into the matrix in order
+                for n in range(len(batches)):
+                    results = await parsed[n]
+                    t0 = time.time()
+                    for file_id, file_index, values in results:
+                        if data is None:
+                            index = file_index
+                            data = np.zeros((len(index), len(self.file_ids)), dtype=values.dtype)
+                        data[:, position[file_id]] = values
+                    busy['assemble'] += time.time() - t0
+                    slots.release()
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+        wall = time.time() - t_start
+        #Fraction of the wall time each stage's workers spent busy, to tune the number of workers
+        self.stats.update({
+            'wall': wall,
+            'download': busy['download'] / (wall * self.producers) if wall else 0.0,
+            'parse': busy['parse'] / (wall * self.parsers) if wall else 0.0,
+            'assemble': busy['assemble'] / wall if wall else 0.0,
+        })
+
+        if data is None:
+            return pd.DataFrame()
+        return pd.DataFrame(data, index=index, columns=self.file_ids)
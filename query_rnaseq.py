@@ -4,9 +4,17 @@ import re
 import gzip
 import pandas as pd
 import tarfile
+import hashlib
 import os
 from io import StringIO
 from io import BytesIO
+from query_pipeline import gdc_pipeline
+from cohort_cache import cohort_cache
+from gene_index import gene_index
+from gdc_download import download_file
+from gdc_download import download_files
+from gdc_download import file_md5
+from gdc_download import data_endpt
 import time
 
 
@@ -29,6 +37,8 @@ class gdc_rnaseq:
         self.data = pd.DataFrame()
         #Initialize empty manifest data matrix
         self.manifest = pd.DataFrame()
+        #Initialize empty matrix of the queried files (id, filename, md5, size)
+        self.files = pd.DataFrame()
         #Initialize the location for the data directory
         self.main_dir = os.path.join(os.getcwd(),"data","RNASeq")
         self.query_dir = os.path.join(self.main_dir,self.name)
@@ -40,13 +50,17 @@ class gdc_rnaseq:
         self.response = ''
         #Initialize variable for size of query
         self.size = ''
+        #Initialize the stage utilization of the last pipelined read
+        self.stats = {}
+        #Initialize the shared memory cache self.data was loaded from, if any
+        self.cache = None
 
-    def data_query(self):
+    def data_files(self):
         '''
-        Performs a query of the NCI genomic portal given a type of cancer.
+        Performs a query of the NCI genomic portal files endpoint given a type of cancer.
         Ex. Type: Hepatocellular Carcinoma - LIHC
         Name followed by no. of samples desired. Ex. LIHC10 returns gene expression for first 10 samples
-        Returns the name of compressed tar.gz file, and a binary data file in memory
+        Returns the list of file uuids matching the query, self.files stores their names and md5s
         '''
 
         files_endpt = "https://api.gdc.cancer.gov/files"
@@ -88,7 +102,7 @@ class gdc_rnaseq:
         # Here a GET is used, so the filter parameters should be passed as a JSON string.
         params = {
             "filters": json.dumps(filters),
-            "fields": "file_id",
+            "fields": "file_id,file_name,md5sum,file_size",
             "format": "JSON",
             "size": size  #Set to the first 10 files for development
             }
@@ -100,6 +114,19 @@ class gdc_rnaseq:
         for file_entry in json.loads(response.content.decode("utf-8"))["data"]["hits"]:
             file_uuid_list.append(file_entry["file_id"])
 
+        #Store the queried files in the layout of a MANIFEST.txt
+        self.files = pd.DataFrame(json.loads(response.content.decode("utf-8"))["data"]["hits"])
+        self.files = self.files.rename(columns={"file_id":"id","file_name":"filename","md5sum":"md5","file_size":"size"})
+
+        return file_uuid_list
+
+    def data_query(self):
+        """
+        Downloads the files returned by self.data_files from the NCI genomic portal
+        Returns the name of compressed tar.gz file, and a binary data file in memory
+        """
+        file_uuid_list = self.data_files()
+
         data_endpt = "https://api.gdc.cancer.gov/data"
 
         params = {"ids": file_uuid_list}
@@ -144,6 +171,46 @@ class gdc_rnaseq:
                 #Set index name
                 self.data.index.name = 'RNASeq_ID'
 
+    def data_read_pipelined(self, producers=4, parsers=None, batch_size=10, queue_size=8):
+        """
+        Pipelined alternative to data_read, overlapping the download, decompression and parsing of the
+        queried files (see query_pipeline.gdc_pipeline)
+        Inputs: producers = concurrent downloads, parsers = parser processes (default: no. of cores),
+        batch_size = files per download, queue_size = max batches held in memory
+        Output: self.data stores a pandas dataframe (gene x sample id),
+        self.stats stores the utilization of every stage
+        """
+        pipeline = gdc_pipeline(self.data_files(), "rnaseq", producers=producers, parsers=parsers,
+                                batch_size=batch_size, queue_size=queue_size)
+        self.data = pipeline.run()
+        #Set index name
+        self.data.index.name = 'RNASeq_ID'
+        self.stats = pipeline.stats
+
+    def data_cached(self, cache=None):
+        """
+        Loads self.data from a shared memory cache, so that parallel worker processes share one copy
+        of the matrix. The first process loads it by reading the saved csv and publishes it.
+        Input: cache = gdc_cache object (default: the cache of the process, see cohort_cache.cohort_cache)
+        Output: self.data stores a read only pandas dataframe backed by shared memory
+        """
+        self.cache = cache or cohort_cache()
+
+        def loader():
+            self.read_csv()
+            return self.data
+
+        self.data = self.cache.data_load(os.path.join("RNASeq",self.name), loader)
+
+    def data_release(self):
+        """
+        Releases the reference of this object to the cached matrix loaded by self.data_cached
+        """
+        if self.cache is not None:
+            self.cache.data_release(os.path.join("RNASeq",self.name))
+            self.cache = None
+            self.data = pd.DataFrame()
+
     def data_save(self, safe=True, format="csv"):
         """
         Saves loaded data as a csv, txt or in parquet format
@@ -216,13 +283,34 @@ class gdc_rnaseq:
         uncomp_targz_dir = os.path.join(self.query_dir,"uncompressed_targz")
         if not os.path.exists(uncomp_targz_dir):
             os.makedirs(uncomp_targz_dir)
-        #Unzips the tar.gz file into desired folder
+        #Unzips the tar.gz file into desired folder, hashing every file as it is written so that
+        #verifying it against the manifest needs no second read
+        digests = {}
         with tarfile.open(targz) as tar:
-            tar.extractall(uncomp_targz_dir)
-            tar.close()
+            for member in tar:
+                path = os.path.join(uncomp_targz_dir,member.name)
+                if not member.isfile() or not os.path.abspath(path).startswith(os.path.abspath(uncomp_targz_dir)+os.sep):
+                    continue
+                if not os.path.exists(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                digest = hashlib.md5()
+                with tar.extractfile(member) as src, open(path,'wb') as dst:
+                    for chunk in iter(lambda: src.read(1<<20), b''):
+                        dst.write(chunk)
+                        digest.update(chunk)
+                digests[member.name] = digest.hexdigest()
         #Stores the manifest of the data
         self.manifest = pd.read_table(os.path.join(uncomp_targz_dir,"MANIFEST.txt"),sep="\t")
 
+        self.data_verify(digests)
+        self.data_write_gz()
+
+    def data_write_gz(self):
+        '''
+        Uncompresses the gz gene expression files under the query directory, and writes them to disk
+        '''
+        uncomp_targz_dir = os.path.join(self.query_dir,"uncompressed_targz")
+
         #Create a path for this uncompressed gz files if it doesnt exist already
         uncomp_gz_dir = os.path.join(uncomp_targz_dir,"uncompressed_gz")
         if not os.path.exists(uncomp_gz_dir):
@@ -240,6 +328,63 @@ class gdc_rnaseq:
 
         self.data_store()
 
+    def data_verify(self, digests=None):
+        """
+        Checks the md5 of every extracted file against the manifest, and downloads the mismatched
+        files again one at a time
+        Input: self.manifest, digests = md5 of the files computed while extracting them, keyed by
+        '<id>/<filename>' (files without a digest are hashed from disk)
+        Output: corrupted files in the uncompressed_targz folder are replaced, returns the list of ids
+        that could not be downloaded again
+        """
+        uncomp_targz_dir = os.path.join(self.query_dir,"uncompressed_targz")
+
+        failed = []
+        for file_id, file_name, md5 in zip(self.manifest['id'], self.manifest['filename'], self.manifest['md5']):
+            path = os.path.join(uncomp_targz_dir,file_id,file_name)
+            if digests is not None and file_id + "/" + file_name in digests:
+                digest = digests[file_id + "/" + file_name]
+            else:
+                digest = file_md5(path) if os.path.exists(path) else None
+            if digest != md5:
+                print("md5 mismatch, downloading " + file_id + " again...")
+                try:
+                    if not os.path.exists(os.path.dirname(path)):
+                        os.makedirs(os.path.dirname(path))
+                    download_file(data_endpt + "/" + file_id, path, md5=md5)
+                except (IOError, requests.exceptions.RequestException) as e:
+                    print("failed to download " + file_id + ": " + str(e))
+                    failed.append(file_id)
+
+        if failed:
+            print(str(len(failed)) + " files failed verification: " + ", ".join(failed))
+        return failed
+
+    def data_download(self):
+        """
+        Resumable alternative to data_write, downloading the queried files one at a time with md5
+        verification. Interrupted files are resumed with HTTP Range requests, including across runs.
+        Output: files and MANIFEST.txt written to the uncompressed_targz folder, self.data stores the
+        gene expression dataframe
+        """
+        if self.files.empty:
+            self.data_files()
+
+        uncomp_targz_dir = os.path.join(self.query_dir,"uncompressed_targz")
+        if not os.path.exists(uncomp_targz_dir):
+            os.makedirs(uncomp_targz_dir)
+
+        failed = download_files(self.files, uncomp_targz_dir)
+        if failed:
+            print(str(len(failed)) + " files failed to download, run method self.data_download again to resume")
+            return
+
+        #Write a manifest so that the folder has the layout of an extracted targz
+        self.manifest = self.files[["id","filename","md5","size"]]
+        self.manifest.to_csv(os.path.join(uncomp_targz_dir,"MANIFEST.txt"),sep="\t",index=False)
+
+        self.data_write_gz()
+
     def data_store(self):
         """
         Saves dataframe to object from uncompressed tar and targz files
@@ -293,6 +438,12 @@ class gdc_rnaseq:
             self.data.to_csv(file)
             print("csv file successfully saved")
 
+    def data_symbols(self):
+        """
+        Returns the gene symbols of the rows (versioned Ensembl ids) of self.data, '' for unknown ids
+        """
+        return gene_index().to_symbol(self.data.index.values)
+
     def read_csv(self):
         """
         Reads data from csv to pandas dataframe
@@ -8,6 +8,7 @@ from io import StringIO
 from io import BytesIO
 import tarfile
 import gzip
+from gene_index import gene_index
 
 class gdc_snv:
     """
@@ -107,6 +108,31 @@ class gdc_snv:
                 usecols = list(range(0,88))+list(range(90,98))+list(range(99,120)),
                 low_memory = False)
 
+    def data_expression(self, rnaseq):
+        """
+        Joins the mutations to an expression matrix on the mutated gene
+        Input: rnaseq = gdc_rnaseq object (or dataframe) indexed by versioned Ensembl ids
+        Output: pandas dataframe (mutation x sample id) of the expression of every mutated gene,
+        NaN for genes missing from the expression matrix
+        """
+        if hasattr(rnaseq, 'data'):
+            rnaseq = rnaseq.data
+        index = gene_index()
+
+        #Expression row of every gene of the index, -1 for genes that were not quantified
+        expr_genes = index.from_ensembl(rnaseq.index.values)
+        rows = np.full(len(index.ensembl), -1)
+        rows[expr_genes[expr_genes >= 0]] = np.flatnonzero(expr_genes >= 0)
+
+        #Mutations are matched on their Ensembl gene, falling back to the Hugo symbol
+        genes = index.from_ensembl(self.data['Gene'].fillna('').values)
+        genes = np.where(genes >= 0, genes, index.from_symbol(self.data['Hugo_Symbol'].fillna('').values))
+        mutation_rows = np.where(genes >= 0, rows[genes], -1)
+
+        values = rnaseq.values[np.maximum(mutation_rows, 0)].astype(float)
+        values[mutation_rows < 0] = np.nan
+        return pd.DataFrame(values, index=self.data.index, columns=rnaseq.columns)
+
     def data_save(self, format="csv"):
         """
         Saves loaded data as a csv or txt file
@@ -0,0 +1,58 @@
+import hashlib
+import threading
+import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import gdc_download
+
+payload = bytes(range(256)) * 1024
+
+def serve(honor_range, drop_after):
+    """
+    Starts a local server for payload that closes the connection after drop_after bytes of every response
+    Inputs: honor_range = answer Range requests with 206 (otherwise 200 with the whole file), drop_after
+    Output: (server, url)
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            start = 0
+            if honor_range and "Range" in self.headers:
+                start = int(self.headers["Range"].split("=")[1].rstrip("-"))
+                self.send_response(206)
+                self.send_header("Content-Range", "bytes %d-%d/%d" % (start, len(payload)-1, len(payload)))
+            else:
+                self.send_response(200)
+            self.send_header("Content-Length", str(len(payload) - start))
+            self.end_headers()
+            self.wfile.write(payload[start:start+drop_after])
+            self.close_connection = True
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://127.0.0.1:%d/file" % server.server_address[1]
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(gdc_download.time, "sleep", lambda seconds: None)
+
+def test_resume_after_drops(tmp_path):
+    server, url = serve(honor_range=True, drop_after=len(payload) // 5)
+    try:
+        path = gdc_download.download_file(url, str(tmp_path / "file"), md5=hashlib.md5(payload).hexdigest(),
+                                          retries=2, chunk_size=1024)
+    finally:
+        server.shutdown()
+    with open(path, "rb") as f:
+        assert f.read() == payload
+
+def test_range_ignored_gives_up(tmp_path):
+    #Every request restarts from zero and drops at the same point, which is no progress
+    server, url = serve(honor_range=False, drop_after=len(payload) // 5)
+    try:
+        with pytest.raises(gdc_download.interrupted):
+            gdc_download.download_file(url, str(tmp_path / "file"), retries=3, chunk_size=1024)
+    finally:
+        server.shutdown()